@@ -1,31 +1,148 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import pandas as pd
 import json
+import os
 import re
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the json module
+    orjson = None
+
+try:
+    import python_calamine  # noqa: F401  (only checks the engine is available)
+    EXCEL_ENGINE = 'calamine'
+except ImportError:  # python-calamine is optional; pandas defaults to openpyxl
+    EXCEL_ENGINE = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional; use pandas' own string storage
+    pyarrow = None
+STRING_DTYPE = 'string[pyarrow]' if pyarrow is not None else 'string'
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; fall back to a linear scan
+    ahocorasick = None
+
+# Patterns used to normalize question text for matching
+_WS_RE = re.compile(r'\s+')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+
+def _dump_json(obj):
+    """Serialize obj as indented UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+# Parquet metadata key holding the workbook's mtime and size
+_CACHE_SOURCE_KEY = b'excel_to_json.source'
+
+# Trie key marking the end of a header; split() never yields empty tokens
+_TRIE_END = ''
+
+# Rows converted to dicts at a time when streaming responses
+STREAM_CHUNK_ROWS = 5000
+
+def _transform_chunk(cleaned_chunk, response_ids, output_keys):
+    """Build response dicts for a chunk of already-cleaned rows"""
+    out = pd.DataFrame({'response_id': response_ids}, index=cleaned_chunk.index)
+    
+    # Assemble one output column per schema question; values are already
+    # cleaned per question and multiple choice is pre-split
+    for question_key in output_keys[1:]:
+        if question_key in cleaned_chunk:
+            out[question_key] = cleaned_chunk[question_key]
+        else:
+            # Questions without a matching column are reported as None
+            out[question_key] = None
+    
+    return out.to_dict(orient='records')
 
 class ExcelSurveyTransformer:
+    # Cleaned values treated as missing
+    _SENTINELS = frozenset({'', 'nan', 'none', '-'})
+    
     def __init__(self, excel_file, schema_file):
         self.excel_file = excel_file
         self.schema_file = schema_file
         self.raw_data = None
         self.schema = None
         self.transformed_data = []
+        self._stripped_cols = {}
+        self._norm_to_col = {}
+        self._norm_order = {}
+        self._trie = {}
+        self._ac = None
+        self._column_map = {}
+        self._skip_set = set()
+        self._active_items = []
+        
+        # Column handler for each question type; unknown types are cleaned as text
+        self._type_handlers = {
+            'multiple_choice': self._process_multiple_choice,
+            'open_text': self._clean_series,
+            'single_choice': self._clean_series,
+            'identifier': self._clean_series,
+        }
         
         # Load Excel data and schema
         self._load_data()
         self._load_schema()
         
     def _load_data(self):
-        """Load Excel data using pandas"""
+        """Load Excel data using pandas, via a parquet cache when it is fresh"""
         try:
-            self.raw_data = pd.read_excel(self.excel_file, sheet_name=0)
+            cache_file = self.excel_file + '.parquet'
+            if self._cache_is_fresh(cache_file):
+                self.raw_data = pd.read_parquet(cache_file)
+                print(f"Using cached copy {cache_file}")
+            else:
+                self.raw_data = pd.read_excel(self.excel_file, sheet_name=0, engine=EXCEL_ENGINE)
+                # Store text columns as contiguous (Arrow) string arrays
+                text_columns = self.raw_data.select_dtypes(include=['object', 'string']).columns
+                self.raw_data = self.raw_data.astype({col: STRING_DTYPE for col in text_columns})
+                self._write_cache(cache_file)
+            self._index_columns()
             print(f"Loaded {len(self.raw_data)} rows from Excel file")
             print(f"Columns: {list(self.raw_data.columns)}")
         except Exception as e:
             print(f"Error loading Excel file: {e}")
             raise
             
+    def _source_signature(self):
+        """Workbook mtime and size, stored with the cache to detect changes"""
+        stat = os.stat(self.excel_file)
+        return json.dumps([stat.st_mtime_ns, stat.st_size]).encode('utf-8')
+    
+    def _cache_is_fresh(self, cache_file):
+        """Check the parquet cache was written from the current workbook"""
+        if pyarrow is None or not os.path.exists(cache_file):
+            return False
+        try:
+            metadata = pyarrow.parquet.read_schema(cache_file).metadata or {}
+        except Exception:
+            return False
+        # Compare for equality so restoring an older workbook is also noticed
+        return metadata.get(_CACHE_SOURCE_KEY) == self._source_signature()
+            
+    def _write_cache(self, cache_file):
+        """Save the parsed sheet as parquet so repeat runs skip the Excel parse"""
+        if pyarrow is None:
+            return
+        try:
+            table = pyarrow.Table.from_pandas(self.raw_data)
+            metadata = {**(table.schema.metadata or {}), _CACHE_SOURCE_KEY: self._source_signature()}
+            pyarrow.parquet.write_table(table.replace_schema_metadata(metadata), cache_file, compression='zstd')
+        except Exception as e:
+            # The cache is only an optimization; never fail the load over it
+            print(f"Warning: Could not write cache file {cache_file}: {e}")
+            
     def _load_schema(self):
         """Load schema from JSON file"""
         try:
@@ -36,67 +153,124 @@ class ExcelSurveyTransformer:
             print(f"Error loading schema file: {e}")
             raise
     
-    def _clean_value(self, value):
-        """Clean and normalize values"""
-        if pd.isna(value):
-            return None
-        
-        # Convert to string and clean
-        cleaned = str(value).strip()
-        
-        # Remove common artifacts
-        cleaned = cleaned.replace('"', '')
-        cleaned = cleaned.replace('\\', '')
-        
-        # Return None for empty strings
-        if not cleaned or cleaned.lower() in ['', 'nan', 'none', '-']:
-            return None
-            
-        return cleaned
-    
-    def _normalize_question_text(self, text):
-        """Normalize question text for matching"""
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _normalize_question_text(text):
+        """Normalize question text for matching (cached per string)"""
         if not text:
             return ""
         # Remove extra whitespace, normalize case
-        normalized = re.sub(r'\s+', ' ', text.strip().lower())
+        normalized = _WS_RE.sub(' ', text.strip().lower())
         # Remove punctuation for fuzzy matching
-        normalized = re.sub(r'[^\w\s]', '', normalized)
+        normalized = _PUNCT_RE.sub('', normalized)
         return normalized
     
+    def _index_columns(self):
+        """Build lookup structures over the normalized Excel headers"""
+        # First column wins when several strip or normalize to the same text
+        self._stripped_cols = {}
+        self._norm_to_col = {}
+        for col in self.raw_data.columns:
+            self._stripped_cols.setdefault(col.strip(), col)
+            self._norm_to_col.setdefault(self._normalize_question_text(col), col)
+        self._norm_order = {norm: i for i, norm in enumerate(self._norm_to_col)}
+        
+        # Word-wise trie of headers, listing those that prefix a question
+        self._trie = {}
+        for norm in self._norm_to_col:
+            node = self._trie
+            for token in norm.split():
+                node = node.setdefault(token, {})
+            if node is not self._trie:
+                node.setdefault(_TRIE_END, norm)
+        
+        # Automaton finding every column header contained in a question
+        self._ac = None
+        if ahocorasick is not None:
+            self._ac = ahocorasick.Automaton()
+            for norm in self._norm_to_col:
+                if norm:
+                    self._ac.add_word(norm, norm)
+            self._ac.make_automaton()
+    
     def _find_column_for_question(self, schema_question):
         """Find Excel column that matches the schema question"""
         schema_normalized = self._normalize_question_text(schema_question)
         
         # Try exact match first
-        for col in self.raw_data.columns:
-            if col.strip() == schema_question:
-                return col
+        hit = self._stripped_cols.get(schema_question)
+        if hit is not None:
+            return hit
         
         # Try normalized fuzzy matching
-        for col in self.raw_data.columns:
-            col_normalized = self._normalize_question_text(col)
-            if col_normalized == schema_normalized:
-                return col
-            
-        # Try partial matching (schema question contained in column)
-        for col in self.raw_data.columns:
-            col_normalized = self._normalize_question_text(col)
-            if schema_normalized in col_normalized or col_normalized in schema_normalized:
-                return col
+        hit = self._norm_to_col.get(schema_normalized)
+        if hit is not None:
+            return hit
+        
+        # Try partial matching (schema question contained in column or vice versa),
+        # starting with the headers that prefix the question, word by word
+        matches = set()
+        node = self._trie
+        for token in schema_normalized.split():
+            node = node.get(token)
+            if node is None:
+                break
+            if _TRIE_END in node:
+                matches.add(node[_TRIE_END])
+        if self._ac is not None and len(self._ac):
+            matches.update(norm for _, norm in self._ac.iter(schema_normalized))
+            if '' in self._norm_to_col:
+                matches.add('')
+            matches.update(norm for norm in self._norm_to_col if schema_normalized in norm)
+        else:
+            matches.update(
+                norm for norm in self._norm_to_col
+                if schema_normalized in norm or norm in schema_normalized
+            )
+        if matches:
+            # Keep the original behaviour of returning the leftmost column
+            return self._norm_to_col[min(matches, key=self._norm_order.__getitem__)]
                 
         return None
     
-    def _process_multiple_choice(self, value, question_info):
-        """Process multiple choice responses (semicolon-separated)"""
-        if not value:
+    def _clean_series(self, series):
+        """Clean and normalize a whole column of values"""
+        cleaned = series.str.strip()
+        
+        # Remove common artifacts
+        cleaned = cleaned.str.replace('"', '', regex=False)
+        cleaned = cleaned.str.replace('\\', '', regex=False)
+        
+        # Return None for empty strings
+        missing = cleaned.isna() | cleaned.str.lower().isin(self._SENTINELS)
+        return cleaned.astype(object).where(~missing, None)
+    
+    def _collapse_whitespace(self, series):
+        """Collapse runs of whitespace in a column to single spaces"""
+        # Non-text columns are stringified with str() so values such as dates
+        # keep the same text they had before the column-wise rewrite
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            series = series.map(str, na_action='ignore')
+        return series.astype(STRING_DTYPE).str.split().str.join(' ')
+    
+    def _process_multiple_choice(self, series):
+        """Process a multiple choice column (semicolon-separated)"""
+        # Split by semicolon once per column, then clean each list
+        return series.str.split(r';(?=\w)', regex=True).apply(self._clean_choices)
+    
+    def _clean_choices(self, parts):
+        """Clean the split parts of one multiple choice response"""
+        if not isinstance(parts, list):
             return None
-            
-        # Split by semicolon and clean each part
-        parts = [self._clean_value(part) for part in re.split(r';(?=\w)', value)]
-        # Remove empty parts
-        clean_parts = [part.strip(';').strip() for part in parts if part]
-
+        
+        clean_parts = []
+        for part in parts:
+            # Clean each part, removing common artifacts
+            part = part.strip().replace('"', '').replace('\\', '')
+            # Remove empty parts
+            if part.lower() not in self._SENTINELS:
+                clean_parts.append(part.strip(';').strip())
+        
         return clean_parts if clean_parts else None
     
     def _skip_metadata_columns(self, col_name):
@@ -107,77 +281,89 @@ class ExcelSurveyTransformer:
         ]
         return any(indicator in col_name.lower() for indicator in metadata_indicators)
     
-    def transform(self):
-        """Transform Excel data according to schema"""
+    def iter_transformed(self):
+        """Transform Excel data according to schema, yielding one response at a time"""
         print("Starting transformation...")
         
-        self.transformed_data = []
-        
         # Get the questions from schema
         questions = self.schema.get('questions', {})
         
-        # Process each row of data
-        for index, row in self.raw_data.iterrows():
-            transformed_row = {
-                'response_id': index + 1  # Add a response ID
-            }
-            
-            # Process each question in the schema
-            for question_key, question_info in questions.items():
-                question_text = question_info.get('question', '')
-                question_type = question_info.get('type', '')
-                
-                # Find the corresponding column in Excel
-                column_name = self._find_column_for_question(question_text)
-                
-                if column_name is None:
-                    print(f"Warning: No column found for question '{question_text}'")
-                    transformed_row[question_key] = None
-                    continue
-                
-                if self._skip_metadata_columns(column_name):
-                    continue
-                    
-                # Get the raw value
-                raw_value = row.get(column_name)
-
-                if isinstance(raw_value, str):
-                    raw_value = ' '.join(raw_value.split())
-
-                # Process based on question type
-                if question_type == 'multiple_choice':
-                    transformed_row[question_key] = self._process_multiple_choice(raw_value, question_info)
-                elif question_type == 'open_text':
-                    cleaned_value = self._clean_value(raw_value)
-                    transformed_row[question_key] = cleaned_value
-                elif question_type == 'single_choice':
-                    cleaned_value = self._clean_value(raw_value)
-                    transformed_row[question_key] = cleaned_value
-                elif question_type == 'identifier':
-                    # Special handling for ID fields
-                    cleaned_value = self._clean_value(raw_value)
-                    transformed_row[question_key] = cleaned_value
-                else:
-                    # Default processing
-                    cleaned_value = self._clean_value(raw_value)
-                    transformed_row[question_key] = cleaned_value
-            
-            self.transformed_data.append(transformed_row)
+        # Resolve schema questions to Excel columns once, not per row
+        self._column_map = {
+            question_key: self._find_column_for_question(question_info.get('question', ''))
+            for question_key, question_info in questions.items()
+        }
+        self._skip_set = {
+            question_key for question_key, column_name in self._column_map.items()
+            if column_name and self._skip_metadata_columns(column_name)
+        }
+        for question_key, column_name in self._column_map.items():
+            if column_name is None:
+                print(f"Warning: No column found for question '{questions[question_key].get('question', '')}'")
+        
+        # Only questions backed by a non-metadata column need processing
+        self._active_items = [
+            (question_key, question_info, self._column_map[question_key])
+            for question_key, question_info in questions.items()
+            if question_key not in self._skip_set and self._column_map[question_key] is not None
+        ]
+        output_keys = ['response_id'] + [
+            question_key for question_key in questions if question_key not in self._skip_set
+        ]
+        
+        # Read the used columns only so later passes touch less memory;
+        # source is never written to, so every handler sees the raw answers
+        needed = list(dict.fromkeys(column_name for _, _, column_name in self._active_items))
+        source = self.raw_data.loc[:, needed]
+        
+        # Clean every used column in one vectorized pass, keyed by question
+        # so questions sharing a column each get their own result
+        cleaned = {}
+        for question_key, question_info, column_name in self._active_items:
+            handler = self._type_handlers.get(question_info.get('type', ''), self._clean_series)
+            cleaned[question_key] = handler(self._collapse_whitespace(source[column_name]))
+        cleaned = pd.DataFrame(cleaned, index=source.index)
+        
+        # Add a response ID, numbered from 1 in row order
+        response_ids = np.arange(1, len(cleaned) + 1, dtype=np.int32)
         
+        # Convert in chunks so only a slice of the dicts is alive at a time
+        for i in range(0, len(cleaned), STREAM_CHUNK_ROWS):
+            chunk = cleaned.iloc[i:i + STREAM_CHUNK_ROWS]
+            ids = response_ids[i:i + STREAM_CHUNK_ROWS]
+            yield from _transform_chunk(chunk, ids, output_keys)
+    
+    def transform(self):
+        """Transform Excel data according to schema"""
+        self.transformed_data = list(self.iter_transformed())
         print(f"Transformed {len(self.transformed_data)} responses")
     
     def save_json(self, output_file):
-        """Save transformed data to JSON file"""
+        """Save transformed data to JSON file, writing responses as they are produced"""
+        # Write next to the target and swap it in, so a failure part-way
+        # through never replaces a previous good file with a truncated one
+        temp_file = output_file + '.tmp'
         try:
-            output_data = {
-                'survey_metadata': self.schema.get('survey_metadata', {}),
-                'responses': self.transformed_data
-            }
+            # Reuse earlier transform() results, otherwise stream them
+            responses = self.transformed_data if self.transformed_data else self.iter_transformed()
+            metadata = _dump_json(self.schema.get('survey_metadata', {}))
             
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
-            print(f"Saved transformed data to {output_file}")
+            with open(temp_file, 'wb') as f:
+                # Same layout as a single indent=2 dump of the whole document
+                f.write(b'{\n  "survey_metadata": ' + metadata.replace(b'\n', b'\n  '))
+                f.write(b',\n  "responses": [')
+                count = 0
+                for response in responses:
+                    f.write((b',' if count else b'') + b'\n    ')
+                    f.write(_dump_json(response).replace(b'\n', b'\n    '))
+                    count += 1
+                f.write(b'\n  ]\n}' if count else b']\n}')
+            os.replace(temp_file, output_file)
+            print(f"Saved {count} transformed responses to {output_file}")
+            return count
         except Exception as e:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
             print(f"Error saving JSON file: {e}")
             raise
     
@@ -205,17 +391,13 @@ def main():
         # Initialize transformer
         transformer = ExcelSurveyTransformer(excel_file, schema_file)
         
-        # Transform the data
-        transformer.transform()
-        
-        # Save to JSON
-        transformer.save_json(output_file)
+        # Transform and save to JSON, streaming responses straight to disk
+        total_responses = transformer.save_json(output_file)
         
         # Print summary
-        summary = transformer.get_summary()
         print(f"\nTransformation Summary:")
-        print(f"- Total responses: {summary['total_responses']}")
-        print(f"- Total questions: {summary['total_questions']}")
+        print(f"- Total responses: {total_responses}")
+        print(f"- Total questions: {len(transformer.schema.get('questions', {}))}")
         
         print(f"\nTransformation complete! Check {output_file} for results.")
         